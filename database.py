@@ -2,7 +2,12 @@
 
 import psycopg2
 import os
+import re
 import logging
+import uuid
+from datetime import date
+from collections import namedtuple
+from functools import lru_cache
 
 # Configuración de Logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -29,11 +34,53 @@ def get_connection():
         logging.error(f"Error al conectar a la base de datos: {e}")
         return None
 
+@lru_cache(maxsize=64)
+def row_class(columns):
+    """
+    Devuelve (y cachea por forma de consulta) una clase de fila compacta para la
+    tupla de nombres de columna dada. Las filas son namedtuples sin __dict__,
+    pero admiten el acceso por nombre de columna como un dict: fila['tkt'],
+    fila.get('tkt', ''), para no romper el código que las usaba como dicts.
+    """
+    base = namedtuple('Fila', columns, rename=True)
+
+    class Fila(base):
+        __slots__ = ()
+        _index = {col: i for i, col in enumerate(columns)}
+
+        def __getitem__(self, key):
+            if key.__class__ is str:
+                return tuple.__getitem__(self, self._index[key])
+            return tuple.__getitem__(self, key)
+
+        def get(self, key, default=None):
+            i = self._index.get(key)
+            return default if i is None else tuple.__getitem__(self, i)
+
+        def keys(self):
+            return self._index.keys()
+
+    return Fila
+
+def _row_class_for(cur):
+    return row_class(tuple(desc[0] for desc in cur.description))
+
 class BaseModel:
     """Clase base para la interacción con la base de datos."""
+    main_column = 'id'
+    # Columna actualizada con now() en cada update (None si la tabla no la tiene)
+    updated_column = None
+    # Si se define, las búsquedas se limitan por defecto a los registros de los
+    # últimos `recent_days` días según `created_column` (particiones recientes)
+    created_column = None
+    recent_days = None
+    # Tabla con los registros archivados, consultada sólo a pedido
+    archive_table = None
+
     def __init__(self, table_name):
         self.table_name = table_name
         self.conn = get_connection()
+        self._column_types = {}
 
     def _execute_query(self, query, params=None, fetch=None):
         """Ejecuta una consulta y maneja la conexión y el cursor."""
@@ -48,14 +95,17 @@ class BaseModel:
                 if fetch == 'one':
                     results = cur.fetchone()
                 elif fetch == 'all':
-                    columns = [desc[0] for desc in cur.description]
-                    results = [dict(zip(columns, row)) for row in cur.fetchall()]
+                    fila = _row_class_for(cur)
+                    results = list(map(fila._make, cur.fetchall()))
                 
                 if "INSERT" in query or "UPDATE" in query or "DELETE" in query:
                     self.conn.commit()
                     if fetch == 'one' and results: # For RETURNING clauses
-                         columns = [desc[0] for desc in cur.description]
-                         results = dict(zip(columns, results))
+                         results = _row_class_for(cur)._make(results)
+                else:
+                    # Lecturas: cerrar la transacción para que la sesión no quede
+                    # "idle in transaction" reteniendo locks sobre las tablas
+                    self.conn.rollback()
 
         except psycopg2.Error as e:
             logging.error(f"Error en la consulta a la tabla {self.table_name}: {e}")
@@ -66,19 +116,124 @@ class BaseModel:
     def close_connection(self):
         if self.conn:
             self.conn.close()
-            
-    def search(self, search_term, column):
-        """Busca un término en una columna específica."""
-        query = f"SELECT * FROM {self.table_name} WHERE {column} ILIKE %s ORDER BY {column};"
-        return self._execute_query(query, (f"%{search_term}%",), fetch='all')
+
+    def iter_query(self, query, params=None, itersize=2000):
+        """
+        Ejecuta una consulta con un cursor del lado del servidor (named cursor)
+        y devuelve los registros de a uno, trayéndolos en lotes de `itersize`.
+
+        El primer elemento producido es la tupla con los nombres de las columnas;
+        los siguientes son las filas. Usa una conexión propia para no interferir
+        con las transacciones de `self.conn` mientras dura la iteración. Los
+        errores de la base se registran y se vuelven a lanzar, para que quien
+        consume el iterador no tome un resultado parcial por completo.
+        """
+        conn = get_connection()
+        if not conn:
+            logging.error("No hay conexión a la base de datos.")
+            return
+        try:
+            with conn.cursor(name=f"cur_{self.table_name}_{uuid.uuid4().hex[:8]}") as cur:
+                cur.execute(query, params)
+                batch = cur.fetchmany(itersize)
+                yield tuple(desc[0] for desc in cur.description)
+                while batch:
+                    yield from batch
+                    batch = cur.fetchmany(itersize)
+            conn.rollback() # Sólo lectura: cierra la transacción del cursor
+        except psycopg2.Error as e:
+            logging.error(f"Error en la consulta a la tabla {self.table_name}: {e}")
+            raise
+        finally:
+            conn.close()
+
+    def _source(self, include_archive=False):
+        """
+        Origen de las consultas de lectura: la tabla, o la tabla más su archivo.
+        En el segundo caso cada fila lleva la columna `archivado`, para que la
+        UI pueda distinguir (y no editar) los registros archivados.
+        """
+        if include_archive and self.archive_table:
+            return (f"(SELECT *, false AS archivado FROM {self.table_name} "
+                    f"UNION ALL SELECT *, true AS archivado FROM {self.archive_table}) AS {self.table_name}")
+        return self.table_name
+
+    def _recent_condition(self, include_archive=False):
+        """Condición que limita la búsqueda a las particiones recientes (vacía si no aplica)."""
+        if self.recent_days and not include_archive:
+            return f" AND {self.created_column} >= now() - interval '{int(self.recent_days)} days'"
+        return ""
+
+    def _search_query(self, search_term, column, include_archive=False):
+        """Devuelve la consulta y los parámetros de búsqueda de un término en una columna."""
+        query = (f"SELECT * FROM {self._source(include_archive)} WHERE {column} ILIKE %s"
+                 f"{self._recent_condition(include_archive)} ORDER BY {column};")
+        return query, (f"%{search_term}%",)
+
+    def search(self, search_term, column, include_archive=False):
+        """
+        Busca un término en una columna específica. En las tablas con
+        `recent_days` sólo se buscan los registros recientes, salvo que se pida
+        incluir el archivo.
+        """
+        query, params = self._search_query(search_term, column, include_archive)
+        return self._execute_query(query, params, fetch='all')
+
+    def iter_search(self, search_term=None, column=None, include_archive=False):
+        """
+        Igual que `search`, pero en streaming. Sin término de búsqueda recorre la
+        tabla completa, sin limitarse a los registros recientes (y con el archivo
+        si `include_archive`). Ver `iter_query` para el formato de los elementos.
+        """
+        column = column or self.main_column
+        if search_term:
+            query, params = self._search_query(search_term, column, include_archive)
+        else:
+            query = f"SELECT * FROM {self._source(include_archive)} ORDER BY {column};"
+            params = None
+        return self.iter_query(query, params)
+
+    def column_type(self, column):
+        """
+        Devuelve (y cachea) el tipo SQL base de una columna de la tabla, o None si
+        no existe. Sin modificador de longitud: `character varying`, no
+        `character varying(10)`, porque un cast explícito a varchar(n) trunca.
+        """
+        column = column.lower()
+        if column not in self._column_types:
+            query = "SELECT format_type(atttypid, NULL) FROM pg_attribute WHERE attrelid = to_regclass(%s) AND attname = %s AND NOT attisdropped;"
+            result = self._execute_query(query, (self.table_name, column), fetch='one')
+            if not result:
+                return None
+            self._column_types[column] = result[0]
+        return self._column_types[column]
+
+    def lookup(self, column, values, include_archive=False):
+        """
+        Busca en bloque los registros cuyo valor en `column` coincida con alguna
+        de las claves de `values`. Las claves se envían como texto y se convierten
+        al tipo de la columna, así también se puede buscar por columnas numéricas
+        como `id`. Cada fila lleva primero la columna `clave_buscada` con la clave
+        tal como se pidió (p. ej. '007' para el id 7), para saber cuál coincidió.
+        """
+        column = column.lower()
+        column_type = self.column_type(column)
+        if column_type is None:
+            logging.error(f"La columna {column} no existe en la tabla {self.table_name}.")
+            return None
+        query = (f"SELECT k.clave_buscada, {self.table_name}.* "
+                 f"FROM unnest(%s::text[]) AS k(clave_buscada) "
+                 f"JOIN {self._source(include_archive)} ON {self.table_name}.{column} = k.clave_buscada::{column_type};")
+        return self._execute_query(query, (list(values),), fetch='all')
 
     def check_exists(self, column, value, exclude_id=None):
-        """Verifica si un valor ya existe en una columna."""
+        """Verifica si un valor ya existe en una columna (incluyendo el archivo, si lo hay)."""
+        source = self._source(include_archive=True)
         if exclude_id:
-            query = f"SELECT EXISTS(SELECT 1 FROM {self.table_name} WHERE {column} = %s AND id != %s);"
+            query = f"SELECT EXISTS(SELECT 1 FROM {source} WHERE {column} = %s AND id != %s);"
             params = (value, exclude_id)
         else:
-            query = f"SELECT EXISTS(SELECT 1 FROM {self.table_name} WHERE {column} = %s);"
+            query = f"SELECT EXISTS(SELECT 1 FROM {source} WHERE {column} = %s);"
             params = (value,)
         
         result = self._execute_query(query, params, fetch='one')
@@ -94,20 +249,54 @@ class BaseModel:
     def update(self, record_id, data):
         """Actualiza un registro existente."""
         set_clause = ", ".join([f"{key} = %s" for key in data.keys()])
+        if self.updated_column:
+            set_clause += f", {self.updated_column} = now()"
         query = f"UPDATE {self.table_name} SET {set_clause} WHERE id = %s RETURNING *;"
         params = tuple(data.values()) + (record_id,)
         return self._execute_query(query, params, fetch='one')
 
 
 class Ticket(BaseModel):
+    main_column = 'tkt'
+    updated_column = 'actualizado_en'
+    created_column = 'creado_en'
+    recent_days = int(os.environ.get("TICKETS_RECENT_DAYS", 180))
+    archive_table = 'tickets_archivo'
+    # Registro no particionado de los tkt (vigentes y archivados) con clave
+    # primaria: garantiza la unicidad que la tabla particionada no puede
+    registry_table = 'tickets_tkt'
+
     def __init__(self):
         super().__init__('tickets')
 
+    def insert(self, data):
+        """Inserta un ticket y registra su tkt en la misma sentencia (falla si ya existe)."""
+        columns = ", ".join(data.keys())
+        placeholders = ", ".join(["%s"] * len(data))
+        query = (f"WITH registro AS (INSERT INTO {self.registry_table} (tkt) VALUES (%s)) "
+                 f"INSERT INTO {self.table_name} ({columns}) VALUES ({placeholders}) RETURNING *;")
+        return self._execute_query(query, (data['tkt'],) + tuple(data.values()), fetch='one')
+
+    def update(self, record_id, data):
+        """Actualiza un ticket y, en la misma sentencia, su tkt en el registro."""
+        if 'tkt' not in data:
+            return super().update(record_id, data)
+        set_clause = ", ".join([f"{key} = %s" for key in data.keys()])
+        query = (f"WITH registro AS (UPDATE {self.registry_table} SET tkt = %s "
+                 f"WHERE tkt = (SELECT tkt FROM {self.table_name} WHERE id = %s)) "
+                 f"UPDATE {self.table_name} SET {set_clause}, {self.updated_column} = now() WHERE id = %s RETURNING *;")
+        params = (data['tkt'], record_id) + tuple(data.values()) + (record_id,)
+        return self._execute_query(query, params, fetch='one')
+
 class Interviniente(BaseModel):
+    main_column = 'interviniente'
+
     def __init__(self):
         super().__init__('intervinientes')
 
 class Productor(BaseModel):
+    main_column = 'codigo'
+
     def __init__(self):
         super().__init__('productores')
     
@@ -116,6 +305,10 @@ class Productor(BaseModel):
         if not search_term:
             return []
 
+        query, params = self._search_query(search_term)
+        return self._execute_query(query, params, fetch='all')
+
+    def _search_query(self, search_term, column=None, include_archive=False):
         # Simplified search: look for search_term in both nombre and codigo
         # This will match "MARTIN" with "MARTIN" and "MARTINEZ"
         query = f"""
@@ -125,16 +318,169 @@ class Productor(BaseModel):
             ORDER BY codigo;
         """
         params = (f"%{search_term}%", f"%{search_term}%")
-        return self._execute_query(query, params, fetch='all')
+        return query, params
 
 class TemaEstado(BaseModel):
+    main_column = 'temaestado'
+
     def __init__(self):
         super().__init__('temaEstado')
 
 class Localidad(BaseModel):
+    main_column = 'localidad'
+
     def __init__(self):
         super().__init__('localidades')
 
+# Modelos disponibles por nombre de tabla (usado por las herramientas de línea de comandos)
+MODELOS = {
+    'tickets': Ticket,
+    'intervinientes': Interviniente,
+    'productores': Productor,
+    'temaEstado': TemaEstado,
+    'localidades': Localidad,
+}
+
+# === Particionado de tickets ===
+# Una partición mensual por rango de creado_en (tickets_pAAAAMM), creada con
+# TICKETS_MONTHS_AHEAD meses de anticipación, más una partición DEFAULT para
+# lo que quede fuera de rango.
+TICKETS_MONTHS_AHEAD = 3
+TICKETS_PARTITION_NAME = re.compile(r'^tickets_p(\d{4})(\d{2})$')
+
+# Espera máxima por locks en el mantenimiento del esquema: si otra sesión tiene
+# tomada la tabla, el mantenimiento falla en vez de encolar a todos los clientes
+MAINTENANCE_LOCK_TIMEOUT = os.environ.get("DB_MAINTENANCE_LOCK_TIMEOUT", "5s")
+
+def _month_start(day, offset=0):
+    """Primer día del mes de `day` desplazado `offset` meses."""
+    month = day.month - 1 + offset
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+def _create_ticket_partition(cur, start, drain_default=False):
+    """
+    Crea la partición mensual que empieza en `start`, si no existe. Si la
+    partición DEFAULT ya tiene filas de ese mes (porque la partición no se creó
+    a tiempo), PostgreSQL rechazaría la creación: con `drain_default` se separa
+    la DEFAULT, se crea la partición, se mueven esas filas y se vuelve a
+    adjuntar; sin él, se deja para el mantenimiento (--archivar).
+    """
+    name = f"tickets_p{start:%Y%m}"
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL;", (name,))
+    if cur.fetchone()[0]:
+        return
+    end = _month_start(start, 1)
+    bounds = f"FROM ('{start}') TO ('{end}')"
+    in_range = f"creado_en >= '{start}' AND creado_en < '{end}'"
+    cur.execute(f"SELECT EXISTS(SELECT 1 FROM tickets_default WHERE {in_range});")
+    if not cur.fetchone()[0]:
+        cur.execute(f"CREATE TABLE {name} PARTITION OF tickets FOR VALUES {bounds};")
+        return
+    if not drain_default:
+        logging.warning(f"La partición DEFAULT tiene tickets de {start:%Y-%m}; "
+                        f"ejecute 'python database.py --archivar MESES' para crear {name}.")
+        return
+    cur.execute("ALTER TABLE tickets DETACH PARTITION tickets_default;")
+    cur.execute(f"CREATE TABLE {name} PARTITION OF tickets FOR VALUES {bounds};")
+    cur.execute(f"INSERT INTO {name} SELECT * FROM tickets_default WHERE {in_range};")
+    cur.execute(f"DELETE FROM tickets_default WHERE {in_range};")
+    cur.execute("ALTER TABLE tickets ATTACH PARTITION tickets_default DEFAULT;")
+    logging.info(f"Filas de la partición DEFAULT movidas a {name}.")
+
+def ensure_ticket_partitions(cur, today=None, drain_default=False):
+    """
+    Crea las particiones mensuales de tickets desde el mes actual hasta
+    TICKETS_MONTHS_AHEAD. Con `drain_default` (sólo en el mantenimiento, porque
+    separa y vuelve a adjuntar la DEFAULT) también crea las de cualquier mes que
+    haya quedado en la partición DEFAULT, moviendo allí esas filas.
+    """
+    today = today or date.today()
+    months = {_month_start(today, offset) for offset in range(TICKETS_MONTHS_AHEAD + 1)}
+    if drain_default:
+        cur.execute("SELECT DISTINCT date_trunc('month', creado_en)::date FROM tickets_default;")
+        months.update(month for (month,) in cur.fetchall())
+    for start in sorted(months):
+        # Cada partición en su propio savepoint: un error no debe abortar el
+        # resto del esquema
+        cur.execute("SAVEPOINT particion;")
+        try:
+            _create_ticket_partition(cur, start, drain_default)
+            cur.execute("RELEASE SAVEPOINT particion;")
+        except psycopg2.Error as e:
+            cur.execute("ROLLBACK TO SAVEPOINT particion;")
+            logging.warning(f"No se pudo crear la partición tickets_p{start:%Y%m}: {e}")
+
+def _rename_legacy_tickets(cur):
+    """
+    Si `tickets` existe como tabla común (esquema anterior, sin particiones), la
+    renombra a tickets_legacy para migrar sus datos. Devuelve True si lo hizo.
+    """
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('tickets');")
+    row = cur.fetchone()
+    if row and row[0] == 'r':
+        logging.info("Migrando la tabla tickets al esquema particionado...")
+        cur.execute("ALTER TABLE tickets RENAME TO tickets_legacy;")
+        return True
+    return False
+
+def _copy_legacy_tickets(cur):
+    """Copia los tickets del esquema anterior (quedan con fecha de creación actual) y los elimina."""
+    cur.execute("INSERT INTO tickets (id, tkt, interno, externo) SELECT id, tkt, interno, externo FROM tickets_legacy;")
+    cur.execute("SELECT setval(pg_get_serial_sequence('tickets', 'id'), COALESCE((SELECT max(id) FROM tickets), 0) + 1, false);")
+    cur.execute("DROP TABLE tickets_legacy;")
+
+def _compress_ticket_archive(cur):
+    """Usa compresión lz4 para los textos del archivo (PostgreSQL 14+); si no está disponible, sigue con pglz."""
+    cur.execute("SAVEPOINT compresion;")
+    try:
+        cur.execute("ALTER TABLE tickets_archivo ALTER COLUMN interno SET COMPRESSION lz4, ALTER COLUMN externo SET COMPRESSION lz4;")
+        cur.execute("RELEASE SAVEPOINT compresion;")
+    except psycopg2.Error:
+        cur.execute("ROLLBACK TO SAVEPOINT compresion;")
+
+def archive_ticket_partitions(older_than_months=12):
+    """
+    Mueve al archivo (tickets_archivo) las particiones mensuales de tickets
+    anteriores a `older_than_months` meses: las separa de la tabla, copia sus
+    filas al archivo comprimido y elimina la partición. Devuelve la cantidad
+    de particiones archivadas. Pensada para ejecutarse periódicamente
+    (`python database.py --archivar MESES`), también mantiene las particiones.
+    """
+    conn = get_connection()
+    if not conn:
+        return 0
+
+    cutoff = _month_start(date.today(), -older_than_months)
+    archived = 0
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SET lock_timeout = %s;", (MAINTENANCE_LOCK_TIMEOUT,))
+            # Mantenimiento previo: particiones nuevas y filas rezagadas en la
+            # DEFAULT pasan a su partición mensual y así también se archivan
+            ensure_ticket_partitions(cur, drain_default=True)
+            conn.commit()
+            cur.execute(
+                "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = 'tickets'::regclass ORDER BY c.relname;"
+            )
+            partitions = [name for (name,) in cur.fetchall()]
+            for name in partitions:
+                match = TICKETS_PARTITION_NAME.match(name)
+                if not match or date(int(match[1]), int(match[2]), 1) >= cutoff:
+                    continue
+                cur.execute(f"ALTER TABLE tickets DETACH PARTITION {name};")
+                cur.execute(f"INSERT INTO tickets_archivo SELECT * FROM {name};")
+                cur.execute(f"DROP TABLE {name};")
+                conn.commit() # Una transacción por partición
+                archived += 1
+                logging.info(f"Partición {name} archivada.")
+    except psycopg2.Error as e:
+        logging.error(f"Error al archivar particiones de tickets: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+    return archived
+
 def create_tables_if_not_exists():
     """Crea todas las tablas en la base de datos si no existen."""
     conn = get_connection()
@@ -142,12 +488,36 @@ def create_tables_if_not_exists():
         return
     
     table_definitions = [
+        # Particionada por fecha de creación. PostgreSQL exige que las claves
+        # únicas incluyan la columna de partición, así que la unicidad de tkt
+        # se garantiza con el registro tickets_tkt (ver Ticket.insert/update).
         """
         CREATE TABLE IF NOT EXISTS tickets (
-            id SERIAL PRIMARY KEY,
-            tkt VARCHAR(10) NOT NULL UNIQUE,
+            id SERIAL,
+            tkt VARCHAR(10) NOT NULL,
             interno TEXT,
-            externo TEXT
+            externo TEXT,
+            creado_en TIMESTAMPTZ NOT NULL DEFAULT now(),
+            actualizado_en TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (id, creado_en)
+        ) PARTITION BY RANGE (creado_en);
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS tickets_default PARTITION OF tickets DEFAULT;
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS tickets_tkt_idx ON tickets (tkt);
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS tickets_archivo (LIKE tickets)
+        WITH (toast_tuple_target = 128);
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS tickets_archivo_tkt_idx ON tickets_archivo (tkt);
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS tickets_tkt (
+            tkt VARCHAR(10) PRIMARY KEY
         );
         """,
         """
@@ -183,8 +553,20 @@ def create_tables_if_not_exists():
     
     try:
         with conn.cursor() as cur:
+            cur.execute("SET lock_timeout = %s;", (MAINTENANCE_LOCK_TIMEOUT,))
+            legacy_tickets = _rename_legacy_tickets(cur)
+            cur.execute("SELECT to_regclass('tickets_tkt') IS NULL, to_regclass('tickets_archivo') IS NULL;")
+            new_registry, new_archive = cur.fetchone()
             for table in table_definitions:
                 cur.execute(table)
+            ensure_ticket_partitions(cur)
+            if new_archive:
+                _compress_ticket_archive(cur)
+            if legacy_tickets:
+                _copy_legacy_tickets(cur)
+            if new_registry:
+                # Primera vez con el registro: se carga con los tkt existentes
+                cur.execute("INSERT INTO tickets_tkt (tkt) SELECT tkt FROM tickets UNION SELECT tkt FROM tickets_archivo;")
         conn.commit()
         logging.info("Tablas verificadas/creadas exitosamente.")
     except psycopg2.Error as e:
@@ -194,4 +576,13 @@ def create_tables_if_not_exists():
             conn.close()
 
 if __name__ == '__main__':
-    create_tables_if_not_exists()
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Crea/actualiza el esquema de la base de datos.")
+    parser.add_argument('--archivar', type=int, metavar='MESES',
+                        help="Además, archiva las particiones de tickets con más de MESES meses.")
+    args = parser.parse_args()
+
+    create_tables_if_not_exists()
+    if args.archivar is not None:
+        logging.info(f"{archive_ticket_partitions(args.archivar)} particiones de tickets archivadas.")
\ No newline at end of file
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+from datetime import datetime
+
+import psycopg2
+
+import database
+
+FORMATOS = ('csv', 'xlsx', 'jsonl')
+
+# Cada cuántas filas se informa el progreso
+PROGRESO_CADA = 5000
+
+# Máximo de filas por hoja que admite Excel (cabecera incluida)
+XLSX_MAX_FILAS = 1048576
+
+def detectar_formato(ruta):
+    """Deduce el formato de exportación a partir de la extensión del archivo."""
+    extension = os.path.splitext(ruta)[1].lower().lstrip('.')
+    return extension if extension in FORMATOS else 'csv'
+
+def escribir_csv(filas, destino, progreso=None):
+    """
+    Escribe en `destino` (un archivo de texto abierto) las filas producidas por
+    `filas`, cuyo primer elemento es la cabecera. Devuelve la cantidad de filas
+    escritas, sin contar la cabecera.
+    """
+    writer = csv.writer(destino)
+    writer.writerow(next(filas))
+    total = 0
+    for fila in filas:
+        writer.writerow(fila)
+        total += 1
+        if progreso and total % PROGRESO_CADA == 0:
+            progreso(total)
+    return total
+
+def escribir_jsonl(filas, destino, progreso=None):
+    """
+    Igual que `escribir_csv`, pero escribe cada fila como un objeto JSON por
+    línea, con la cabecera como claves.
+    """
+    columnas = next(filas)
+    total = 0
+    for fila in filas:
+        destino.write(json.dumps(dict(zip(columnas, fila)), ensure_ascii=False, default=str))
+        destino.write('\n')
+        total += 1
+        if progreso and total % PROGRESO_CADA == 0:
+            progreso(total)
+    return total
+
+def escribir_xlsx(filas, ruta, progreso=None):
+    """
+    Escribe las filas en un libro XLSX usando el modo write_only de openpyxl,
+    que vuelca cada fila a disco sin mantener la hoja en memoria. Al llegar al
+    límite de filas de Excel se continúa en una hoja nueva, con la cabecera
+    repetida.
+    """
+    try:
+        from openpyxl import Workbook
+    except ImportError:
+        logging.error("Para exportar a XLSX es necesario instalar openpyxl.")
+        return None
+
+    libro = Workbook(write_only=True)
+    cabecera = list(next(filas))
+    hoja = libro.create_sheet("Hoja1")
+    hoja.append(cabecera)
+    filas_hoja = 1
+    total = 0
+    for fila in filas:
+        if filas_hoja == XLSX_MAX_FILAS:
+            hoja = libro.create_sheet(f"Hoja{len(libro.worksheets) + 1}")
+            hoja.append(cabecera)
+            filas_hoja = 1
+        hoja.append([_valor_xlsx(valor) for valor in fila])
+        filas_hoja += 1
+        total += 1
+        if progreso and total % PROGRESO_CADA == 0:
+            progreso(total)
+    libro.save(ruta)
+    return total
+
+def _valor_xlsx(valor):
+    """Excel no admite zonas horarias: las fechas se escriben en hora local."""
+    if isinstance(valor, datetime) and valor.tzinfo is not None:
+        return valor.astimezone().replace(tzinfo=None)
+    return valor
+
+def _eliminar_parcial(ruta):
+    """Borra el archivo de una exportación fallida, si llegó a crearse."""
+    try:
+        os.remove(ruta)
+    except OSError:
+        pass
+
+def exportar(filas, ruta, formato=None, progreso=None):
+    """
+    Exporta un iterable de filas (cabecera primero, ver `BaseModel.iter_query`)
+    a un archivo CSV, XLSX o JSONL. `progreso` se llama periódicamente con la
+    cantidad de filas escritas. Devuelve el total de filas exportadas o None si
+    falla; en ese caso se elimina el archivo parcial.
+    """
+    formato = formato or detectar_formato(ruta)
+    filas = iter(filas)
+    try:
+        if formato == 'xlsx':
+            total = escribir_xlsx(filas, ruta, progreso)
+        elif formato == 'jsonl':
+            with open(ruta, 'w', encoding='utf-8') as destino:
+                total = escribir_jsonl(filas, destino, progreso)
+        else:
+            # utf-8-sig para que Excel reconozca los acentos al abrir el CSV
+            with open(ruta, 'w', newline='', encoding='utf-8-sig') as destino:
+                total = escribir_csv(filas, destino, progreso)
+    except StopIteration:
+        logging.error(f"No se pudieron obtener los datos para exportar a {ruta}.")
+        _eliminar_parcial(ruta)
+        return None
+    except psycopg2.Error:
+        logging.error(f"La exportación a {ruta} se interrumpió por un error de la base de datos.")
+        _eliminar_parcial(ruta)
+        return None
+    except OSError as e:
+        logging.error(f"Error al escribir el archivo {ruta}: {e}")
+        _eliminar_parcial(ruta)
+        return None
+
+    if total is not None:
+        if progreso:
+            progreso(total)
+        logging.info(f"Exportadas {total} filas a {ruta}.")
+    return total
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Exporta una tabla (o el resultado de una búsqueda) a CSV, XLSX o JSONL.")
+    parser.add_argument('tabla', choices=sorted(database.MODELOS), help="Tabla a exportar.")
+    parser.add_argument('salida', help="Archivo de salida (.csv, .xlsx o .jsonl).")
+    parser.add_argument('--buscar', help="Término de búsqueda; sin él se exporta la tabla completa, no sólo lo reciente.")
+    parser.add_argument('--columna', help="Columna donde buscar (por defecto, la columna principal de la tabla).")
+    parser.add_argument('--archivo', action='store_true', help="Incluye los registros archivados (sólo tickets). Con --buscar y sin --archivo, sólo se buscan los tickets recientes (TICKETS_RECENT_DAYS).")
+    parser.add_argument('--formato', choices=FORMATOS, help="Formato de salida; por defecto se deduce de la extensión.")
+    args = parser.parse_args(argv)
+
+    model = database.MODELOS[args.tabla]()
+    try:
+        filas = model.iter_search(args.buscar, args.columna, include_archive=args.archivo)
+        total = exportar(filas, args.salida, args.formato,
+                         progreso=lambda n: logging.info(f"{n} filas exportadas..."))
+    finally:
+        model.close_connection()
+    return 0 if total is not None else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
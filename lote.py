@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import logging
+import sys
+from itertools import islice
+
+import database
+import exportacion
+
+# Cantidad de claves que se resuelven en cada consulta
+TAMANIO_LOTE = 5000
+
+def leer_claves(origen, mayusculas=False):
+    """Lee una clave por línea, ignorando espacios y líneas vacías."""
+    for linea in origen:
+        clave = linea.strip()
+        if clave:
+            yield clave.upper() if mayusculas else clave
+
+def en_lotes(claves, tamanio):
+    """Agrupa las claves en listas de hasta `tamanio` elementos, omitiendo las ya vistas en lotes anteriores."""
+    vistas = set()
+    nuevas = (clave for clave in claves if not (clave in vistas or vistas.add(clave)))
+    while True:
+        lote = list(islice(nuevas, tamanio))
+        if not lote:
+            return
+        yield lote
+
+def resolver(model, column, claves, faltantes, tamanio=TAMANIO_LOTE, include_archive=False):
+    """
+    Resuelve las claves contra la tabla del modelo con una consulta por lote
+    (ver `BaseModel.lookup`). Produce la cabecera y luego las filas encontradas
+    (el formato de `BaseModel.iter_query`) y agrega a `faltantes` las claves que
+    la base no hizo coincidir con ningún registro.
+    """
+    cabecera_enviada = False
+    for lote in en_lotes(claves, tamanio):
+        filas = model.lookup(column, lote, include_archive)
+        if filas is None:
+            raise RuntimeError(f"Error al consultar la tabla {model.table_name}.")
+        encontradas = set()
+        for fila in filas:
+            if not cabecera_enviada:
+                yield tuple(fila.keys())
+                cabecera_enviada = True
+            encontradas.add(fila['clave_buscada'])
+            yield fila
+        faltantes.extend(clave for clave in lote if clave not in encontradas)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Busca en bloque una lista de claves (una por línea) y emite los registros encontrados.")
+    parser.add_argument('tabla', choices=sorted(database.MODELOS), help="Tabla donde buscar.")
+    parser.add_argument('claves', nargs='?', default='-', help="Archivo con una clave por línea ('-' o vacío para leer de stdin).")
+    parser.add_argument('--columna', help="Columna a comparar (por defecto, la columna principal de la tabla).")
+    parser.add_argument('--formato', choices=('csv', 'jsonl'), default='csv', help="Formato de salida.")
+    parser.add_argument('--salida', default='-', help="Archivo de salida ('-' para stdout).")
+    parser.add_argument('--faltantes', help="Archivo donde escribir las claves que no se encontraron.")
+    parser.add_argument('--mayusculas', action='store_true', help="Convierte las claves a mayúsculas antes de buscar.")
+    parser.add_argument('--archivo', action='store_true', help="Busca también en los registros archivados (sólo tickets).")
+    parser.add_argument('--lote', type=int, default=TAMANIO_LOTE, help="Claves por consulta.")
+    args = parser.parse_args(argv)
+
+    model = database.MODELOS[args.tabla]()
+    # Las claves del resultado vienen en minúsculas (temaEstado -> temaestado)
+    column = (args.columna or model.main_column).lower()
+    escribir = exportacion.escribir_jsonl if args.formato == 'jsonl' else exportacion.escribir_csv
+
+    origen = destino = None
+    faltantes = []
+    try:
+        origen = sys.stdin if args.claves == '-' else open(args.claves, encoding='utf-8')
+        destino = sys.stdout if args.salida == '-' else open(args.salida, 'w', newline='', encoding='utf-8')
+        filas = resolver(model, column, leer_claves(origen, args.mayusculas), faltantes, args.lote, args.archivo)
+        try:
+            total = escribir(filas, destino, progreso=lambda n: logging.info(f"{n} registros encontrados..."))
+        except StopIteration: # Ninguna clave encontrada
+            total = 0
+    except OSError as e:
+        logging.error(f"Error de archivo: {e}")
+        return 1
+    except RuntimeError as e:
+        logging.error(e)
+        return 1
+    finally:
+        model.close_connection()
+        if origen not in (None, sys.stdin):
+            origen.close()
+        if destino not in (None, sys.stdout):
+            destino.close()
+
+    if args.faltantes:
+        with open(args.faltantes, 'w', encoding='utf-8') as archivo:
+            archivo.writelines(f"{clave}\n" for clave in faltantes)
+    logging.info(f"{total} registros encontrados, {len(faltantes)} claves sin registro.")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
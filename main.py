@@ -2,8 +2,15 @@
 
 import flet as ft
 import database
+import exportacion
+import trazas
+import logging
+import os
 import re
+import threading
+import time
 from functools import partial
+from trazas import traced
 
 class CrudUI(ft.Container):
     """
@@ -20,6 +27,41 @@ class CrudUI(ft.Container):
         self.column_definitions = column_definitions
         
         self.selected_rows = {}
+        # IDs de la tabla principal que vienen del archivo (no se pueden editar)
+        self.archived_ids = set()
+        self._export_source = None
+        # Última búsqueda ejecutada (término, columna, opciones), para exportarla
+        # aunque el campo de búsqueda ya se haya vaciado
+        self._last_search = None
+        self.tracer = trazas.tracer
+
+        # Claves de datos de cada columna (ID + datos, sin Acciones), calculadas una sola vez
+        self._column_keys = [col.label.value.replace('-', '').lower() for col in self.column_definitions[:-1]]
+        # Índices de esas columnas dentro de cada clase de fila (ver database.row_class)
+        self._column_indexes = {}
+
+        # Selector de archivo para exportar; se agrega una única vez al overlay
+        self.export_picker = ft.FilePicker(on_result=self.on_export_path_selected)
+        self.page.overlay.append(self.export_picker)
+
+        # Diálogo de formulario reutilizable: se crea y se agrega al overlay una
+        # sola vez, y se vuelve a completar en cada alta o edición
+        self._editing_item_id = None
+        self.form_dialog_title = ft.Text()
+        self.form_dialog = ft.AlertDialog(
+            modal=True,
+            title=self.form_dialog_title,
+            content=ft.Column(controls=list(self.form_fields.values()), width=750), # Set width on the content Column
+            actions=[
+                ft.TextButton("Cancelar", on_click=self.close_dialog),
+                ft.ElevatedButton("Guardar", on_click=self.save_form)
+            ],
+            actions_alignment=ft.MainAxisAlignment.END,
+        )
+        self.page.overlay.append(self.form_dialog)
+
+        self.snackbar_text = ft.Text()
+        self.snackbar = ft.SnackBar(content=self.snackbar_text)
 
         # --- Componentes de la UI ---
         self.search_field = ft.TextField(
@@ -28,6 +70,8 @@ class CrudUI(ft.Container):
             capitalization=ft.TextCapitalization.CHARACTERS,
             on_submit=self.execute_search
         )
+        # Sólo para modelos con tabla de archivo (tickets): por defecto se busca en lo reciente
+        self.archive_checkbox = ft.Checkbox(label="Buscar en archivo", value=False, visible=bool(self.model.archive_table))
         
         self.main_datatable = ft.DataTable(columns=self.column_definitions, rows=[])
         
@@ -45,6 +89,27 @@ class CrudUI(ft.Container):
             ]
         )
 
+        self.export_progress = ft.ProgressBar(width=350, visible=False)
+        self.export_status = ft.Text(visible=False)
+
+        # Panel de depuración con las últimas acciones trazadas (sólo con ASSISTANT_TRACE=1)
+        self.debug_panel_lines = ft.Column(spacing=0)
+        self.debug_panel_stats = ft.Text(size=12, font_family="monospace")
+        self.debug_panel = ft.Column(
+            visible=self.tracer.enabled,
+            controls=[
+                ft.Text("Trazas (últimas acciones)", size=14, weight=ft.FontWeight.BOLD),
+                # Los contadores recorren todo el árbol de controles: sólo a pedido
+                ft.Row([
+                    ft.TextButton("Actualizar contadores", on_click=self.refresh_debug_stats),
+                    self.debug_panel_stats,
+                ]),
+                ft.Container(content=self.debug_panel_lines, border=ft.border.all(1, ft.Colors.GREY_300), border_radius=5, padding=5)
+            ]
+        )
+        if self.tracer.enabled:
+            self.tracer.listeners.append(self.on_trace_record)
+
         self.main_data_view = ft.Column(
             controls=[
                 ft.Text(f"{self.entity_name} Seleccionados", size=18, weight=ft.FontWeight.BOLD),
@@ -56,17 +121,31 @@ class CrudUI(ft.Container):
             controls=[
                 ft.Row(
                     [
-                        self.search_field,
-                        ft.IconButton(icon=ft.Icons.ADD_CIRCLE_OUTLINE, on_click=lambda e: self.open_form_dialog(), tooltip=f"Crear Nuevo {self.entity_name}")
+                        ft.Row([self.search_field, self.archive_checkbox]),
+                        ft.Row([
+                            ft.PopupMenuButton(
+                                icon=ft.Icons.DOWNLOAD,
+                                tooltip="Exportar",
+                                items=[
+                                    ft.PopupMenuItem(text="Exportar resultados de la última búsqueda", on_click=lambda e: self.start_export("search")),
+                                    ft.PopupMenuItem(text=f"Exportar tabla completa de {self.entity_name}", on_click=lambda e: self.start_export("table")),
+                                    ft.PopupMenuItem(text=f"Exportar {self.entity_name} seleccionados", on_click=lambda e: self.start_export("selected")),
+                                ]
+                            ),
+                            ft.IconButton(icon=ft.Icons.ADD_CIRCLE_OUTLINE, on_click=lambda e: self.open_form_dialog(), tooltip=f"Crear Nuevo {self.entity_name}")
+                        ])
                     ],
                     alignment=ft.MainAxisAlignment.SPACE_BETWEEN
                 ),
+                ft.Row([self.export_progress, self.export_status]),
                 ft.Divider(),
                 self.results_view,
-                self.main_data_view
+                self.main_data_view,
+                self.debug_panel
             ]
         )
 
+    @traced("execute_search")
     def execute_search(self, e):
         search_term = self.search_field.value.strip()
         if not search_term:
@@ -74,40 +153,73 @@ class CrudUI(ft.Container):
         
         # Usar el método de búsqueda específico del modelo si existe
         found_results = []
+        search_options = self.search_options()
+        self._last_search = (search_term, self.main_column, search_options)
         if hasattr(self.model, 'search') and callable(getattr(self.model, 'search')):
             # Check if the model's search method is the generic BaseModel.search
             # or a specialized one that doesn't need 'column'
-            if self.model.search.__qualname__ == 'BaseModel.search':
-                found_results = self.model.search(search_term, self.main_column)
-            else:
-                # Assume specialized search methods don't need 'column'
-                found_results = self.model.search(search_term)
+            with self.tracer.span("db"):
+                if self.model.search.__qualname__ == 'BaseModel.search':
+                    found_results = self.model.search(search_term, self.main_column, **search_options)
+                else:
+                    # Assume specialized search methods don't need 'column'
+                    found_results = self.model.search(search_term)
         else:
             # Fallback if no search method is found (shouldn't happen with BaseModel)
             self.show_snackbar("Error: No search method found for this entity.", is_error=True)
             return
 
-        if not found_results:
+        only_recent = search_options.get("include_archive") is False and self.model.recent_days
+        if not found_results and only_recent:
+            # Se buscó sólo en lo reciente: puede existir un registro más antiguo
+            with self.tracer.span("db"):
+                exists = self.model.check_exists(self.main_column, search_term)
+            if exists:
+                self.show_snackbar(f"'{search_term}' no está entre los {self.entity_name} de los últimos {self.model.recent_days} días, "
+                                   f"pero existe uno más antiguo. Active 'Buscar en archivo' para encontrarlo.", is_error=True)
+            else:
+                self.show_snackbar(f"No se encontraron resultados en los últimos {self.model.recent_days} días "
+                                   f"(active 'Buscar en archivo' para ver los anteriores). Puede crear uno nuevo.")
+                self.open_form_dialog(search_term_as_value=search_term)
+        elif not found_results:
             self.show_snackbar(f"No se encontraron resultados. Puede crear uno nuevo.")
             self.open_form_dialog(search_term_as_value=search_term)
         elif len(found_results) == 1:
             self.add_to_main_table(found_results[0])
         else:
-            self.populate_results_table(found_results)
+            with self.tracer.span("build"):
+                self.populate_results_table(found_results)
             self.results_view.visible = True
         
         self.search_field.value = ""
-        self.update()
+        with self.tracer.span("update"):
+            self.update()
+
+    def search_options(self):
+        """Opciones de búsqueda adicionales según el modelo (p. ej. incluir el archivo)."""
+        if self.model.archive_table:
+            return {"include_archive": bool(self.archive_checkbox.value)}
+        return {}
 
     def generic_search(self, search_term):
         return self.model.search(search_term, self.main_column)
 
+    def row_values(self, data):
+        """Devuelve los valores de `data` en el orden de las columnas (ID + datos)."""
+        row_type = type(data)
+        indexes = self._column_indexes.get(row_type)
+        if indexes is None:
+            index = getattr(row_type, '_index', None)
+            if index is None: # dict u otro mapeo
+                return [data.get(key, '') for key in self._column_keys]
+            indexes = self._column_indexes[row_type] = [index.get(key) for key in self._column_keys]
+        return ['' if i is None else tuple.__getitem__(data, i) for i in indexes]
+
     def populate_results_table(self, results):
         self.results_datatable.rows.clear()
         for res in results:
             cells = [ft.DataCell(ft.IconButton(icon=ft.Icons.ADD_TASK, tooltip="Seleccionar", on_click=partial(self.select_from_results, res)))]
-            for col in self.column_definitions[1:-1]: # Iterar sobre las columnas de datos
-                cells.append(ft.DataCell(ft.Text(res.get(col.label.value.replace('-', '').lower(), ''))))
+            cells.extend(ft.DataCell(ft.Text(value)) for value in self.row_values(res)[1:]) # Columnas de datos
             self.results_datatable.rows.append(ft.DataRow(cells=cells))
 
     def select_from_results(self, data, e):
@@ -118,37 +230,46 @@ class CrudUI(ft.Container):
         self.results_view.visible = False
         self.update()
 
+    @traced("add_to_main_table")
     def add_to_main_table(self, data):
         item_id = str(data['id'])
         if item_id in self.selected_rows:
             self.show_snackbar(f"'{data[self.main_column]}' ya está en la lista.")
             return
 
-        new_row = ft.DataRow(
-            cells=[ft.DataCell(ft.Text(str(data.get(col.label.value.replace('-', '').lower(), '')))) for col in self.column_definitions[:-1]] + # Datos
-                  [ft.DataCell(ft.Row([ # Acciones
-                      ft.IconButton(icon=ft.Icons.EDIT, tooltip="Editar", on_click=partial(self.open_form_dialog, item_id=item_id)),
-                      ft.IconButton(icon=ft.Icons.DELETE, tooltip="Eliminar", on_click=partial(self.remove_from_main_table, item_id)),
-                  ]))]
-        )
+        with self.tracer.span("build"):
+            new_row = ft.DataRow(
+                cells=[ft.DataCell(ft.Text(str(value))) for value in self.row_values(data)] + # Datos
+                      [ft.DataCell(ft.Row([ # Acciones
+                          ft.IconButton(icon=ft.Icons.EDIT, tooltip="Editar", on_click=partial(self.open_form_dialog, item_id=item_id)),
+                          ft.IconButton(icon=ft.Icons.DELETE, tooltip="Eliminar", on_click=partial(self.remove_from_main_table, item_id)),
+                      ]))]
+            )
         self.selected_rows[item_id] = new_row
+        if data.get('archivado'):
+            self.archived_ids.add(item_id)
         self.main_datatable.rows.append(new_row)
-        self.main_datatable.rows.sort(key=lambda r: r.cells[1].content.value) # Ordenar por la columna principal
-        self.update()
+        with self.tracer.span("sort"):
+            self.main_datatable.rows.sort(key=lambda r: r.cells[1].content.value) # Ordenar por la columna principal
+        with self.tracer.span("update"):
+            self.update()
 
     def remove_from_main_table(self, item_id, e):
         if item_id in self.selected_rows:
             row_to_remove = self.selected_rows.pop(item_id)
+            self.archived_ids.discard(item_id)
             self.main_datatable.rows.remove(row_to_remove)
             self.update()
             self.show_snackbar(f"{self.entity_name} eliminado de la vista.")
 
+    @traced("open_form_dialog")
     def open_form_dialog(self, e=None, item_id=None, search_term_as_value=None):
+        if item_id in self.archived_ids:
+            self.show_snackbar(f"Este {self.entity_name} está archivado y no se puede editar.", is_error=True)
+            return
         is_edit = item_id is not None
-        title_text = f"Editar {self.entity_name}" if is_edit else f"Crear Nuevo {self.entity_name}"
-        
-        form_controls = []
-        # initial_data = {} # Removed, as it's not used
+        self.form_dialog_title.value = f"Editar {self.entity_name}" if is_edit else f"Crear Nuevo {self.entity_name}"
+        self._editing_item_id = item_id
 
         if is_edit:
             # En una app real, aquí se haría una consulta a la DB para obtener los datos frescos
@@ -158,7 +279,6 @@ class CrudUI(ft.Container):
                 # This assumes the order of form_fields matches the order of columns in the row
                 # and that the row.cells[0] is ID, row.cells[1] is the first data column
                 field.value = row.cells[i+1].content.value
-                # initial_data[field.label.lower()] = field.value # Removed, as it's not used
         else:
             for field in self.form_fields.values():
                 field.value = ""
@@ -166,28 +286,13 @@ class CrudUI(ft.Container):
                 main_field = list(self.form_fields.values())[0]
                 main_field.value = search_term_as_value.upper()
 
+        self.form_dialog.open = True
+        with self.tracer.span("update"):
+            self.page.update()
 
-        for field in self.form_fields.values():
-            form_controls.append(field)
-
-        dialog = ft.AlertDialog(
-            modal=True,
-            title=ft.Text(title_text),
-            content=ft.Column(controls=form_controls, width=750), # Set width on the content Column
-            actions=[
-                ft.TextButton("Cancelar", on_click=lambda e: self.close_dialog(dialog)),
-                ft.ElevatedButton("Guardar", on_click=lambda e: self.save_form(dialog, item_id)) # Re-added Guardar button
-            ],
-            actions_alignment=ft.MainAxisAlignment.END,
-            
-        )
-        
-        # Add dialog to page.overlay and open it
-        self.page.overlay.append(dialog)
-        dialog.open = True
-        self.page.update()
-
-    def save_form(self, dialog, item_id=None):
+    @traced("save_form")
+    def save_form(self, e=None):
+        item_id = self._editing_item_id
         data = {key: field.value.strip() for key, field in self.form_fields.items()}
         
         # --- VALIDACIÓN (Ejemplo simple) ---
@@ -195,15 +300,18 @@ class CrudUI(ft.Container):
             self.show_snackbar(f"El campo {self.main_column.upper()} no puede estar vacío.", is_error=True)
             return
         
-        if self.model.check_exists(self.main_column, data[self.main_column], exclude_id=item_id):
+        with self.tracer.span("db"):
+            exists = self.model.check_exists(self.main_column, data[self.main_column], exclude_id=item_id)
+        if exists:
             self.show_snackbar(f"Este valor '{data[self.main_column]}' ya existe.", is_error=True)
             return
 
         # --- LÓGICA DE GUARDADO ---
-        if item_id: # Editar
-            result = self.model.update(item_id, data)
-        else: # Crear
-            result = self.model.insert(data)
+        with self.tracer.span("db"):
+            if item_id: # Editar
+                result = self.model.update(item_id, data)
+            else: # Crear
+                result = self.model.insert(data)
 
         if result:
             if item_id:
@@ -211,7 +319,7 @@ class CrudUI(ft.Container):
             else:
                 self.add_to_main_table(result)
             self.show_snackbar(f"{self.entity_name} guardado con éxito.")
-            self.close_dialog(dialog)
+            self.close_dialog()
         else:
             self.show_snackbar(f"Error al guardar {self.entity_name}.", is_error=True)
 
@@ -219,22 +327,141 @@ class CrudUI(ft.Container):
         item_id = str(data['id'])
         if item_id in self.selected_rows:
             row_to_update = self.selected_rows[item_id]
-            for i, col in enumerate(self.column_definitions[:-1]): # Excluir Acciones
-                row_to_update.cells[i].content.value = str(data.get(col.label.value.replace('-', '').lower(), ''))
-            self.main_datatable.rows.sort(key=lambda r: r.cells[1].content.value)
-            self.update()
+            for cell, value in zip(row_to_update.cells, self.row_values(data)): # Excluir Acciones
+                cell.content.value = str(value)
+            with self.tracer.span("sort"):
+                self.main_datatable.rows.sort(key=lambda r: r.cells[1].content.value)
+            with self.tracer.span("update"):
+                self.update()
+
+    def close_dialog(self, e=None):
+        self.form_dialog.open = False
+        self._editing_item_id = None
+        with self.tracer.span("update"):
+            self.page.update()
+
+    # --- Exportación ---
+
+    def start_export(self, source):
+        """Pide el archivo de destino; la exportación sigue en on_export_path_selected."""
+        if source == "selected" and not self.selected_rows:
+            self.show_snackbar(f"No hay {self.entity_name} seleccionados para exportar.", is_error=True)
+            return
+        if source == "search" and not self._last_search:
+            self.show_snackbar("Todavía no se realizó ninguna búsqueda para exportar.", is_error=True)
+            return
+        self._export_source = source
+        self.export_picker.save_file(
+            dialog_title=f"Exportar {self.entity_name}",
+            file_name=f"{self.model.table_name}.csv",
+            allowed_extensions=list(exportacion.FORMATOS),
+        )
+
+    def on_export_path_selected(self, e):
+        if not e.path:
+            return
+        if self._export_source == "selected":
+            rows = self.iter_selected_rows()
+        elif self._export_source == "search":
+            search_term, column, search_options = self._last_search
+            rows = self.model.iter_search(search_term, column, **search_options)
+        else:
+            # Tabla completa: todos los registros, incluidos los archivados
+            rows = self.model.iter_search(None, self.main_column, include_archive=True)
+
+        self.export_progress.value = None # Indeterminada: no se conoce el total
+        self.export_progress.visible = True
+        self.export_status.visible = True
+        self.update_export_progress(0)
+
+        total = exportacion.exportar(rows, e.path, progreso=self.update_export_progress)
+
+        self.export_progress.visible = False
+        self.export_status.visible = False
+        self.update()
+        if total is None:
+            self.show_snackbar("Error al exportar.", is_error=True)
+        else:
+            self.show_snackbar(f"Se exportaron {total} filas a {e.path}.")
 
-    def close_dialog(self, dialog):
-        dialog.open = False
-        self.page.update()
+    def update_export_progress(self, count):
+        self.export_status.value = f"{count} filas exportadas..."
+        self.update()
+
+    def iter_selected_rows(self):
+        """Recorre las filas de la tabla principal con el formato de `BaseModel.iter_query`."""
+        yield tuple(col.label.value for col in self.column_definitions[:-1])
+        for row in self.main_datatable.rows:
+            yield tuple(cell.content.value for cell in row.cells[:-1])
 
     def show_snackbar(self, message, is_error=False):
-        self.page.snack_bar = ft.SnackBar(
-            content=ft.Text(message),
-            bgcolor=ft.Colors.RED_500 if is_error else ft.Colors.GREEN_500,
-        )
+        self.snackbar_text.value = message
+        self.snackbar.bgcolor = ft.Colors.RED_500 if is_error else ft.Colors.GREEN_500
+        self.page.snack_bar = self.snackbar
         self.page.snack_bar.open = True
-        self.page.update()
+        with self.tracer.span("update"):
+            self.page.update()
+
+    def on_trace_record(self, record):
+        """Muestra en el panel de depuración las acciones trazadas de esta vista."""
+        if record["entity"] != self.entity_name:
+            return
+        lines = [trazas.format_record(r) for r in self.tracer.recent if r["entity"] == self.entity_name][-10:]
+        self.debug_panel_lines.controls = [ft.Text(line, size=12, font_family="monospace") for line in reversed(lines)]
+        if self.debug_panel.page:
+            self.debug_panel.update()
+
+    def refresh_debug_stats(self, e=None):
+        stats = self.get_memory_stats()
+        self.debug_panel_stats.value = "  ".join(f"{key}={value}" for key, value in stats.items())
+        self.debug_panel.update()
+
+    def get_memory_stats(self):
+        """
+        Devuelve contadores para verificar que el uso de memoria se mantiene
+        estable en sesiones largas: controles en el overlay de la página,
+        controles de esta vista y filas en las tablas.
+        """
+        return {
+            "overlay": len(self.page.overlay),
+            "controles": count_controls(self),
+            "filas_principales": len(self.main_datatable.rows),
+            "filas_resultados": len(self.results_datatable.rows),
+        }
+
+
+# Atributos públicos de flet que pueden contener controles hijos
+CHILD_ATTRIBUTES = ("content", "controls", "rows", "cells", "columns", "label", "title", "actions")
+
+# Cada cuántos segundos se registran en el log los contadores de memoria (0 = nunca)
+MEMORY_LOG_SECONDS = int(os.environ.get("ASSISTANT_MEMORY_LOG_SECONDS", 900))
+
+def count_controls(control):
+    """Cuenta un control y todos sus descendientes, recorriendo sólo atributos públicos."""
+    total = 0
+    pending = [control]
+    while pending:
+        current = pending.pop()
+        total += 1
+        for attribute in CHILD_ATTRIBUTES:
+            child = getattr(current, attribute, None)
+            if isinstance(child, ft.Control):
+                pending.append(child)
+            elif isinstance(child, list):
+                pending.extend(c for c in list(child) if isinstance(c, ft.Control))
+    return total
+
+def log_memory_stats(views, interval):
+    """Registra periódicamente los contadores de memoria de cada vista (hilo de fondo)."""
+    while True:
+        time.sleep(interval)
+        for view in views:
+            try:
+                stats = view.get_memory_stats()
+            except Exception as e: # Nunca debe tumbar la aplicación
+                logging.warning(f"No se pudieron calcular los contadores de {view.entity_name}: {e}")
+                continue
+            logging.info(f"Memoria {view.entity_name}: " + "  ".join(f"{key}={value}" for key, value in stats.items()))
 
 
 def main(page: ft.Page):
@@ -361,6 +588,10 @@ def main(page: ft.Page):
     page.add(tabs)
     page.update()
 
+    if MEMORY_LOG_SECONDS > 0:
+        views = [tkt_view, interviniente_view, productor_view, tema_estado_view, localidad_view]
+        threading.Thread(target=log_memory_stats, args=(views, MEMORY_LOG_SECONDS), daemon=True).start()
+
 
 if __name__ == "__main__":
     ft.app(target=main)
\ No newline at end of file
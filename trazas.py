@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from logging.handlers import RotatingFileHandler
+
+# === Configuración del trazado (opcional, desactivado por defecto) ===
+TRACE_ENABLED = os.environ.get("ASSISTANT_TRACE", "0") == "1"
+TRACE_FILE = os.environ.get("ASSISTANT_TRACE_FILE", "trazas.jsonl")
+TRACE_MAX_BYTES = int(os.environ.get("ASSISTANT_TRACE_MAX_BYTES", 5 * 1024 * 1024))
+TRACE_BACKUP_COUNT = int(os.environ.get("ASSISTANT_TRACE_BACKUP_COUNT", 3))
+
+class Tracer:
+    """
+    Mide la latencia de las acciones de la UI y la desglosa en tramos (spans):
+    'db' (consultas), 'build' (construcción de controles), 'sort' y 'update'
+    (page.update / control.update). Las acciones anidadas quedan como hijas
+    ('children') de la acción que las llamó, cada una con sus tramos. Cada
+    acción terminada se guarda en memoria para el panel de depuración y se
+    escribe como una línea en un archivo JSONL rotativo.
+    """
+    def __init__(self, enabled=TRACE_ENABLED, path=TRACE_FILE, keep=50):
+        self.enabled = enabled
+        self.path = path
+        self.recent = deque(maxlen=keep)
+        self.listeners = []
+        self._local = threading.local()
+        self._logger = None
+
+    def _get_logger(self):
+        if self._logger is None:
+            logger = logging.getLogger("assistant.trazas")
+            logger.propagate = False
+            handler = RotatingFileHandler(self.path, maxBytes=TRACE_MAX_BYTES,
+                                          backupCount=TRACE_BACKUP_COUNT, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger.addHandler(handler)
+            logger.setLevel(logging.INFO)
+            self._logger = logger
+        return self._logger
+
+    @contextmanager
+    def _action(self, name, entity):
+        parent = getattr(self._local, "action", None)
+        record = {"action": name, "spans": {}, "children": []}
+        if parent is None:
+            record.update(ts=time.time(), entity=entity)
+        else:
+            # Acción anidada (p. ej. add_to_main_table dentro de execute_search):
+            # se registra como hija, con sus propios tramos, para que los tramos
+            # de cada registro no se superpongan
+            parent["children"].append(record)
+        self._local.action = record
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record["total_ms"] = round((time.perf_counter() - start) * 1000, 3)
+            self._local.action = parent
+            if parent is None:
+                self._finish(record)
+
+    @contextmanager
+    def _span(self, kind):
+        record = self._local.action
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            record["spans"][kind] = round(record["spans"].get(kind, 0) + elapsed, 3)
+
+    def action(self, name, entity=None):
+        """Contexto que mide una acción completa de la UI."""
+        if not self.enabled:
+            return nullcontext()
+        return self._action(name, entity)
+
+    def span(self, kind):
+        """Contexto que suma el tiempo transcurrido al tramo `kind` de la acción en curso."""
+        if not self.enabled or getattr(self._local, "action", None) is None:
+            return nullcontext()
+        return self._span(kind)
+
+    def _finish(self, record):
+        self.recent.append(record)
+        try:
+            self._get_logger().info(json.dumps(record, ensure_ascii=False))
+        except OSError as e:
+            logging.error(f"No se pudo escribir la traza en {self.path}: {e}")
+        for listener in self.listeners:
+            # Un error al mostrar la traza no debe reemplazar el resultado (o la
+            # excepción) del manejador trazado
+            try:
+                listener(record)
+            except Exception:
+                logging.exception("Error en un listener de trazas.")
+
+tracer = Tracer()
+
+def traced(name):
+    """
+    Decorador para los manejadores de eventos de una vista: mide la llamada como
+    la acción `name`, usando el `tracer` y el `entity_name` de la instancia.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.tracer.action(name, self.entity_name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+def format_record(record):
+    """Resumen de una línea de una acción trazada, para el panel de depuración."""
+    spans = "  ".join(f"{kind}={ms:.1f}ms" for kind, ms in record["spans"].items())
+    children = "".join(f"  [{format_record(child)}]" for child in record["children"])
+    return f"{record['action']}: {record['total_ms']:.1f}ms  {spans}{children}"